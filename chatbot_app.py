@@ -4,11 +4,12 @@ This script handles the entire user interaction flow: selecting a company
 and financial documents, interacting with the AI, and saving the results.
 """
 import os
-import glob
+import asyncio
 import argparse
+import json
 import logging
+import numbers
 from datetime import datetime
-import time
 import pandas as pd
 from typing import Dict, List, Tuple, Any, Optional
 import re
@@ -16,7 +17,8 @@ import re
 # Local imports
 from src.utils.api_key_loader import load_api_key
 from src.llm_processing.gemini_service import GeminiService
-from src.utils.report_generator import generate_chat_transcript, generate_extraction_log
+from src.llm_processing.upload_cache import UploadCache, UploadedPdfRegistry
+from src.utils.report_generator import generate_chat_transcript, ExtractionLog
 from src.config import settings
 from src.utils.cli_utils import log_and_print, prompt_user
 import google.generativeai as genai
@@ -25,6 +27,71 @@ import google.generativeai as genai
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+_CODE_FENCE_RE = re.compile(r"```(?:json)?")
+
+# Patterns used when cleaning extracted table values
+_CURRENCY_RE = re.compile(r'[$,€]')
+_NA_SET = frozenset({'', 'n/a', 'not applicable'})
+_DASH_SET = frozenset({'-', '–', '—'})
+
+# Characters not allowed in sheet names for tables outside settings.TARGET_TABLES
+_UNSAFE_SHEET_CHARS_RE = re.compile(r'[^\w ]')
+
+# This format displays numbers with thousands separators and no decimal places.
+# Excel handles using '.' or ',' for separators based on the user's system locale.
+NUMBER_FORMAT = '#,##0'
+
+def _build_batched_preset_prompt(items: List[Tuple[str, int, str]]) -> str:
+    """Combines all preset questions into one numbered prompt that asks for a JSON list of answers."""
+    lines = [
+        "Answer each of the following numbered questions using the attached PDFs. "
+        "Return a JSON list with fields {id, category, answer}, where id is the question number "
+        "and answer follows the response structure described above."
+    ]
+    for question_id, (category, _, question) in enumerate(items, start=1):
+        lines.append(f"{question_id}. ({category}) {question}")
+    return "\n".join(lines)
+
+def _parse_batched_answers(response_text: str, num_questions: int) -> Dict[int, str]:
+    """
+    Parses the JSON list returned for a batched prompt.
+    Returns a mapping of zero-based question index to answer; unusable entries are left out.
+    """
+    try:
+        entries = json.loads(response_text)
+    except json.JSONDecodeError:
+        # The model often wraps JSON in a Markdown code fence, so retry with just the list.
+        stripped = _CODE_FENCE_RE.sub("", response_text)
+        try:
+            entries = json.loads(stripped[stripped.find("["):stripped.rfind("]") + 1])
+        except json.JSONDecodeError:
+            return {}
+
+    answers = {}
+    if not isinstance(entries, list):
+        return answers
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get("answer"), str):
+            continue
+        try:
+            index = int(entry.get("id")) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < num_questions and entry["answer"].strip():
+            answers[index] = entry["answer"].strip()
+    return answers
+
+async def _answer_questions_concurrently(gemini_service: GeminiService, uploaded_pdf_files_map: Dict[str, Any],
+                                         questions: List[str]) -> List[Any]:
+    """Sends all questions to Gemini at once, capped by a semaphore. Results keep the input order."""
+    semaphore = asyncio.Semaphore(settings.PRESET_QUESTION_CONCURRENCY)
+
+    async def ask(question: str):
+        async with semaphore:
+            return await gemini_service.agenerate_chat_response(uploaded_pdf_files_map, question)
+
+    return await asyncio.gather(*(ask(question) for question in questions), return_exceptions=True)
+
 def ask_preset_questions(gemini_service: GeminiService, uploaded_pdf_files_map: Dict[str, Any], chat_history: List[Tuple[str, str]]):
     """Runs through a list of preset questions and records the AI's answers."""
     if not uploaded_pdf_files_map:
@@ -35,32 +102,47 @@ def ask_preset_questions(gemini_service: GeminiService, uploaded_pdf_files_map:
     print("\n--- Answering Preset Financial Questions ---")
     logger.info("Starting to answer preset financial questions.")
 
-    for category, questions in settings.PRESET_FINANCIAL_QUESTIONS.items():
-        print(f"\n** {category} **")
-        for i, question in enumerate(questions):
-            print(f"\nPreset Question {i+1}: {question}")
-            logger.info(f"Asking preset question: {question}")
+    # Flatten the categories so every question can be sent in parallel.
+    items = [(category, i, question)
+             for category, questions in settings.PRESET_FINANCIAL_QUESTIONS.items()
+             for i, question in enumerate(questions)]
+
+    # Ask everything in one request so the PDFs are only processed once.
+    llm_response, error_message = gemini_service.generate_chat_response(
+        uploaded_pdf_files_map, _build_batched_preset_prompt(items))
+    answers = _parse_batched_answers(llm_response, len(items)) if llm_response else {}
+    results: List[Any] = [(answers[index], None) if index in answers else None for index in range(len(items))]
+
+    # Fall back to one request per question for anything the batched answer did not cover.
+    missing = [index for index, result in enumerate(results) if result is None]
+    if missing:
+        logger.warning(f"Batched preset answer unusable for {len(missing)} question(s) "
+                       f"({error_message or 'missing from the batched response'}). Asking them individually.")
+        fallback_results = asyncio.run(_answer_questions_concurrently(
+            gemini_service, uploaded_pdf_files_map, [items[index][2] for index in missing]))
+        for index, result in zip(missing, fallback_results):
+            results[index] = result
+
+    current_category = None
+    for (category, i, question), result in zip(items, results):
+        if category != current_category:
+            print(f"\n** {category} **")
+            current_category = category
+        print(f"\nPreset Question {i+1}: {question}")
+        logger.info(f"Answered preset question: {question}")
+
+        if isinstance(result, Exception):
+            logger.error(f"An unexpected error occurred while asking a preset question: {result}", exc_info=result)
+            response = f"An unexpected critical error occurred: {result}"
+        else:
+            llm_response, error_message = result
+            if llm_response:
+                response = llm_response
+            else:
+                response = f"Sorry, I encountered an error processing this preset question. {error_message or ''}"
 
-            try:
-                llm_response, error_message = gemini_service.generate_chat_response(
-                    uploaded_pdf_files_map,
-                    question
-                )
-
-                if llm_response:
-                    print(f"\nChatbot: {llm_response}")
-                    chat_history.append((f"Preset Question ({category} - {i+1}): {question}", f"Chatbot: {llm_response}"))
-                else:
-                    error_response = f"Sorry, I encountered an error processing this preset question. {error_message or ''}"
-                    print(f"\nChatbot: {error_response}")
-                    chat_history.append((f"Preset Question ({category} - {i+1}): {question}", f"Chatbot: {error_response}"))
-            except Exception as e:
-                logger.error(f"An unexpected error occurred while asking a preset question: {e}", exc_info=True)
-                error_response = f"An unexpected critical error occurred: {e}"
-                print(f"\nChatbot: {error_response}")
-                chat_history.append((f"Preset Question ({category} - {i+1}): {question}", f"Chatbot: {error_response}"))
-            
-            time.sleep(1)  # Small delay to avoid hitting API rate limits too quickly.
+        print(f"\nChatbot: {response}")
+        chat_history.append((f"Preset Question ({category} - {i+1}): {question}", f"Chatbot: {response}"))
 
     print("\n--- Finished Answering Preset Financial Questions ---")
     logger.info("Finished answering preset financial questions.")
@@ -78,6 +160,12 @@ def parse_arguments() -> argparse.Namespace:
                         help="Base folder to save Word chat transcripts and extraction logs.")
     parser.add_argument("--api_key_file", type=str, default=settings.API_KEY_FILE,
                         help="Path to the API key file.")
+    parser.add_argument("--no_cache_uploads", action="store_true",
+                        help="Always upload PDFs again instead of reusing ones uploaded in earlier sessions, "
+                             "and delete them when the session ends.")
+    parser.add_argument("--no_extraction_cache", action="store_true",
+                        help="Extract tables again even if a cached result exists for the PDF. "
+                             "The new result replaces the cached one.")
     return parser.parse_args()
 
 def setup_company_paths(args: argparse.Namespace, company_name: str) -> Dict[str, str]:
@@ -97,7 +185,9 @@ def select_company(pdf_folder: str) -> Optional[str]:
         log_and_print(f"Error: Base PDF folder '{pdf_folder}' not found.", level=logging.ERROR)
         return None
 
-    available_companies = [d for d in os.listdir(pdf_folder) if os.path.isdir(os.path.join(pdf_folder, d))]
+    # scandir reports the entry type from the directory listing itself, avoiding a stat() per entry.
+    with os.scandir(pdf_folder) as entries:
+        available_companies = sorted(entry.name for entry in entries if entry.is_dir())
     
     if not available_companies:
         log_and_print(f"Warning: No company subdirectories found in '{pdf_folder}'.", level=logging.WARNING)
@@ -118,67 +208,105 @@ def select_company(pdf_folder: str) -> Optional[str]:
         logger.info("User skipped company selection for chat.")
         return "General_Chat_NoCompany"
 
-def select_analysis_pdfs(company_pdf_folder: str, company_name: str) -> Tuple[Optional[str], List[str], str]:
-    """Asks user for single/multi-year analysis and which PDFs to use."""
-    all_pdf_paths = sorted(glob.glob(os.path.join(company_pdf_folder, "*.pdf")))
+def list_pdfs(folder: str) -> List[str]:
+    """
+    Returns the sorted paths of the PDF files in a folder, or an empty list if the folder does not exist.
+    Hidden files (such as macOS '._report.pdf' metadata files) are skipped, as glob did.
+    """
+    try:
+        with os.scandir(folder) as entries:
+            return sorted(entry.path for entry in entries
+                          if entry.is_file() and not entry.name.startswith('.') and entry.name.lower().endswith('.pdf'))
+    except FileNotFoundError:
+        return []
+
+def select_analysis_pdfs(company_pdf_folder: str, company_name: str) -> Tuple[Optional[str], List[str], str, List[str]]:
+    """
+    Asks user for single/multi-year analysis and which PDFs to use.
+    Also returns every PDF found in the folder, so callers do not have to scan it again.
+    """
+    all_pdf_paths = list_pdfs(company_pdf_folder)
     if not all_pdf_paths:
         log_and_print(f"Warning: No PDF files found for {company_name}.", level=logging.WARNING)
-        return None, [], f"Chat for {company_name} (No PDFs found)"
+        return None, [], f"Chat for {company_name} (No PDFs found)", all_pdf_paths
     
     analysis_choice = prompt_user(
         f"For {company_name}, select analysis type:",
         {"1": "Single-Year (one PDF for chat)", "2": "Multi-Year (all PDFs for chat)"}
     )
     if not analysis_choice:
-        return None, [], "Cancelled"
+        return None, [], "Cancelled", all_pdf_paths
 
     if analysis_choice == "1":
         pdf_options = {str(i+1): os.path.basename(p) for i, p in enumerate(all_pdf_paths)}
         pdf_choice_key = prompt_user("Select PDF for Single-Year Analysis:", pdf_options)
         
         if not pdf_choice_key:
-            return None, [], "Cancelled"
+            return None, [], "Cancelled", all_pdf_paths
             
         selected_pdf = all_pdf_paths[int(pdf_choice_key) - 1]
         desc = f"Single-Year Analysis for {company_name} ({os.path.basename(selected_pdf)})"
         logger.info(f"User selected single PDF: {os.path.basename(selected_pdf)}")
-        return "single", [selected_pdf], desc
+        return "single", [selected_pdf], desc, all_pdf_paths
     else: # analysis_choice == "2"
         desc = f"Multi-Year Analysis for {company_name}"
         logger.info(f"User selected Multi-Year Analysis. Using all {len(all_pdf_paths)} PDFs.")
-        return "multi", all_pdf_paths, desc
+        return "multi", all_pdf_paths, desc, all_pdf_paths
 
-def _clean_and_convert_to_numeric(value: Any) -> Any:
+def _clean_numeric_column(column: pd.Series) -> pd.Series:
     """
-    Cleans up number strings from the PDF to be usable in Excel.
-    Handles things like '$', ',', and '(123)' for negatives.
+    Cleans up number strings from the PDF to be usable in Excel, a whole column at a time.
+    Handles things like '$', ',', and '(123)' for negatives. Values that are not
+    numbers after cleaning are kept as they were.
     """
-    if not isinstance(value, str):
-        return value  # Return non-string values as is
-
-    cleaned_value = value.strip()
-    
-    if not cleaned_value or cleaned_value.lower() in ['n/a', 'not applicable']:
-        return None  # Represent empty or N/A as blank cells
-
-    # Handle accounting-style dashes for zero
-    if cleaned_value in ('-', '–', '—'):
-        return 0.0
-
-    # Handle parentheses for negative numbers, e.g., (1,234) -> -1234
-    if cleaned_value.startswith('(') and cleaned_value.endswith(')'):
-        cleaned_value = '-' + cleaned_value[1:-1]
-        
-    # Remove currency symbols and commas
-    cleaned_value = re.sub(r'[$,€]', '', cleaned_value)
-    cleaned_value = cleaned_value.replace(',', '')
-
-    try:
-        # Convert to float
-        return float(cleaned_value)
-    except (ValueError, TypeError):
-        # If conversion fails, return the original string value
-        return value
+    stripped = column.astype(str).str.strip()
+    is_blank = stripped.str.lower().isin(_NA_SET)
+    is_dash = stripped.isin(_DASH_SET)  # Accounting-style dashes for zero
+    is_negative = stripped.str.startswith('(') & stripped.str.endswith(')')
+
+    # Drop the parentheses of negative numbers, e.g., (1,234) -> 1,234, then currency symbols and commas.
+    digits = stripped.where(~is_negative, stripped.str[1:-1])
+    digits = digits.str.replace(_CURRENCY_RE, '', regex=True)
+    numbers = pd.to_numeric(digits, errors='coerce')
+    numbers = numbers.where(~is_negative, -numbers)
+
+    # Where conversion failed, fall back to the original value.
+    cleaned = numbers.astype(object).where(numbers.notna(), column)
+    cleaned[is_dash] = 0.0
+    cleaned[is_blank] = None  # Represent empty or N/A as blank cells
+    return cleaned.infer_objects()
+
+def _has_numbers(column: pd.Series) -> bool:
+    """Checks whether a column holds any numbers, i.e. whether it needs the number format."""
+    # Blank and n/a cells are NaN after cleaning, and NaN is a Number too, so leave them out.
+    values = column.dropna()
+    if pd.api.types.is_numeric_dtype(values):
+        return not values.empty
+    return bool(values.map(lambda value: isinstance(value, numbers.Number) and not isinstance(value, bool)).any())
+
+def _cell_width(value: Any) -> int:
+    """Display length of a value, measuring numbers as formatted with NUMBER_FORMAT."""
+    if value is None:
+        return 0
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return len(f"{value:,.0f}")
+    return len(str(value))
+
+def _column_width(column: pd.Series) -> int:
+    """Widest display length in a column; blank cells count as zero."""
+    values = column.dropna()
+    if values.empty:
+        return 0
+    if pd.api.types.is_numeric_dtype(values):
+        # The longest formatted number is always the smallest or the largest one.
+        return max(_cell_width(values.min()), _cell_width(values.max()))
+    return max(map(_cell_width, values))
+
+def _column_widths(df: pd.DataFrame) -> List[int]:
+    """Auto-fit widths for every column of a sheet, computed from the DataFrame alone."""
+    header_widths = [len(str(header_value)) for header_value in df.columns]
+    cell_widths = [_column_width(df.iloc[:, j]) for j in range(len(df.columns))]
+    return [max(header_width, cell_width) + 2 for header_width, cell_width in zip(header_widths, cell_widths)]
 
 def save_tables_to_excel(excel_path: str, tables_data: Dict[str, List[List[Any]]], pdf_filename: str):
     """
@@ -187,10 +315,13 @@ def save_tables_to_excel(excel_path: str, tables_data: Dict[str, List[List[Any]]
     """
     sheets_to_write = {}
     for table_name, table_data in tables_data.items():
-        if not (isinstance(table_data, list) and len(table_data) > 0 and 
-                isinstance(table_data[0], list) and table_data != [["Table Not Found"]]):
+        if not isinstance(table_data, list) or not table_data or not isinstance(table_data[0], list):
             logger.warning(f"Skipping malformed table '{table_name}' from {pdf_filename} (invalid structure).")
             continue
+        # Only a single-row table can be the sentinel, so real tables are never compared cell by cell.
+        if len(table_data) == 1 and table_data[0] == ["Table Not Found"]:
+            logger.info(f"Skipping table '{table_name}' from {pdf_filename} (not found in the document).")
+            continue
 
         header = table_data[0]
         data_rows = table_data[1:]
@@ -200,69 +331,85 @@ def save_tables_to_excel(excel_path: str, tables_data: Dict[str, List[List[Any]]
             logger.warning(f"Skipping table '{table_name}' from {pdf_filename} due to empty header.")
             continue
 
-        processed_rows = []
-        for i, row in enumerate(data_rows):
-            row_copy = list(row) if isinstance(row, list) else []
-            if len(row_copy) > num_header_cols:
-                row_copy = row_copy[:num_header_cols]
-            elif len(row_copy) < num_header_cols:
-                row_copy.extend([""] * (num_header_cols - len(row_copy)))
-            
-            cleaned_row = [_clean_and_convert_to_numeric(cell) for cell in row_copy]
-            processed_rows.append(cleaned_row)
-        
-        if not processed_rows:
-            logger.warning(f"No valid data rows found for table '{table_name}' after processing.")
+        if not data_rows:
+            logger.warning(f"No valid data rows found for table '{table_name}'.")
             continue
             
         try:
-            df = pd.DataFrame(processed_rows, columns=header)
-            safe_sheet_name = "".join(c for c in table_name if c.isalnum() or c in (' ', '_')).strip()[:31]
+            # Let pandas pad short rows and truncate long ones to the header width.
+            df = pd.DataFrame([row if isinstance(row, list) else [] for row in data_rows])
+            if df.shape[1] < num_header_cols:
+                df = df.reindex(columns=range(num_header_cols), fill_value="")
+            elif df.shape[1] > num_header_cols:
+                df = df.iloc[:, :num_header_cols]
+            df.columns = header
+            df = df.apply(_clean_numeric_column)
+            safe_sheet_name = (settings.TARGET_TABLE_SAFE_NAMES.get(table_name)
+                               or _UNSAFE_SHEET_CHARS_RE.sub('', table_name).strip()[:31])
             sheets_to_write[safe_sheet_name] = df
         except Exception as e:
             logger.error(f"Pandas could not create DataFrame for table '{table_name}': {e}", exc_info=True)
 
     if not sheets_to_write:
         logger.warning(f"No valid tables could be processed for {pdf_filename}. No Excel file will be created.")
-        print(f"  No valid tables found to save for {pdf_filename}.")
         return
 
     try:
-        with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
+        with pd.ExcelWriter(excel_path, engine='xlsxwriter') as writer:
+            number_format = writer.book.add_format({'num_format': NUMBER_FORMAT})
+
             for sheet_name, df in sheets_to_write.items():
                 df.to_excel(writer, sheet_name=sheet_name, index=False)
-                
-                # Apply Number Formatting and Auto-Fit Columns
                 worksheet = writer.sheets[sheet_name]
-                
-                # This format string displays numbers with thousands separators and no decimal places.
-                # Excel handles using '.' or ',' for separators based on the user's system locale.
-                number_format = '#,##0'
-                
-                # Apply format to all numeric cells
-                for row in worksheet.iter_rows(min_row=2): # Skip header row
-                    for cell in row:
-                        if isinstance(cell.value, (int, float)):
-                            cell.number_format = number_format
-                
-                # Auto-fit column widths for better readability
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = (max_length + 2)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
+
+                # Auto-fit column widths and apply the number format one whole column at a time.
+                for j, width in enumerate(_column_widths(df)):
+                    if _has_numbers(df.iloc[:, j]):
+                        worksheet.set_column(j, j, width, number_format)
+                    else:
+                        worksheet.set_column(j, j, width)
 
         logger.info(f"Successfully wrote and formatted {len(sheets_to_write)} sheet(s) to {excel_path}")
-        print(f"  Tables extracted and formatted to: {excel_path}")
     except Exception as e:
         logger.error(f"Failed to write final Excel file at {excel_path}: {e}", exc_info=True)
-        print(f"  Error writing final Excel file: {e}")
+
+async def _extract_tables_concurrently(gemini_service: GeminiService, pdf_paths: List[str],
+                                      excel_output_folder: str, extraction_log: ExtractionLog):
+    """
+    Extracts tables from several PDFs at once. Each PDF is saved to Excel and
+    added to the extraction log as soon as it is done. Progress is shown as a bar;
+    per-PDF details go to the logger and the extraction log.
+    """
+    print(f"\nExtracting tables from {len(pdf_paths)} PDF(s)...")
+    failures = 0
+    async for pdf_path, extracted_data, error, duration in gemini_service.aextract_tables_from_pdfs(
+            pdf_paths, settings.TARGET_TABLES, settings.EXTRACTION_CONCURRENCY, show_progress=True):
+        pdf_filename = os.path.basename(pdf_path)
+        logger.debug(f"Finished processing for tables: {pdf_filename} ({duration:.1f}s)")
+        log_entry = {'pdf_filename': pdf_filename, 'processing_time_seconds': duration}
+
+        if error:
+            failures += 1
+            log_entry.update({'status': 'Failure', 'message': error, 'extracted_tables': []})
+            logger.error(f"Error extracting tables from {pdf_filename}: {error}")
+        elif extracted_data:
+            excel_file_path = os.path.join(excel_output_folder, f"{os.path.splitext(pdf_filename)[0]}_extracted_tables.xlsx")
+            # Write the Excel file in a thread so the remaining PDFs keep talking to the API meanwhile.
+            await asyncio.to_thread(save_tables_to_excel, excel_file_path, extracted_data, pdf_filename)
+
+            extracted_names = [name for name, data in extracted_data.items() if data and data != [["Table Not Found"]]]
+            log_entry.update({
+                'status': 'Success' if extracted_names else 'Partial Success (No Tables Found)',
+                'message': f'Extraction process completed. See log for table details. Saved to: {excel_file_path}',
+                'extracted_tables': extracted_names or ["None"]
+            })
+        else:
+            failures += 1
+            log_entry.update({'status': 'Failure', 'message': 'No data returned from service.', 'extracted_tables': []})
+
+        extraction_log.append(log_entry)
+
+    print(f"Table extraction finished: {len(pdf_paths) - failures} of {len(pdf_paths)} PDF(s) processed successfully.")
 
 def handle_table_extraction(gemini_service: GeminiService, company_name: str, all_pdfs: List[str],
                             analysis_choice: str, selected_single_pdf: Optional[str],
@@ -303,60 +450,46 @@ def handle_table_extraction(gemini_service: GeminiService, company_name: str, al
         return
 
     logger.info(f"Starting table extraction for {len(pdfs_to_process)} PDF(s).")
-    extraction_log_entries = []
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_filepath = os.path.join(log_output_folder, f"{company_name}_extraction_log_{timestamp}.docx")
 
-    for pdf_path in pdfs_to_process:
-        pdf_filename = os.path.basename(pdf_path)
-        print(f"\nProcessing for tables: {pdf_filename}")
-        start_time = time.time()
-        
-        extracted_data, error = gemini_service.extract_tables_from_pdf(pdf_path, settings.TARGET_TABLES)
-        
-        duration = time.time() - start_time
-        log_entry = {'pdf_filename': pdf_filename, 'processing_time_seconds': duration}
+    # Each PDF's entry is written to the log as soon as it finishes.
+    with ExtractionLog(log_filepath) as extraction_log:
+        asyncio.run(_extract_tables_concurrently(gemini_service, pdfs_to_process, excel_output_folder, extraction_log))
+    print(f"\nTable extraction log saved to: {log_filepath}")
 
-        if error:
-            log_entry.update({'status': 'Failure', 'message': error, 'extracted_tables': []})
-            print(f"  Error extracting tables: {error}")
-        elif extracted_data:
-            excel_file_path = os.path.join(excel_output_folder, f"{os.path.splitext(pdf_filename)[0]}_extracted_tables.xlsx")
-            save_tables_to_excel(excel_file_path, extracted_data, pdf_filename)
-            
-            extracted_names = [name for name, data in extracted_data.items() if data and data != [["Table Not Found"]]]
-            log_entry.update({
-                'status': 'Success' if extracted_names else 'Partial Success (No Tables Found)',
-                'message': f'Extraction process completed. See log for table details. Saved to: {excel_file_path}',
-                'extracted_tables': extracted_names or ["None"]
-            })
-        else:
-             log_entry.update({'status': 'Failure', 'message': 'No data returned from service.', 'extracted_tables': []})
-
-        extraction_log_entries.append(log_entry)
-
-    # Save the log file for the session
-    if extraction_log_entries:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_filepath = os.path.join(log_output_folder, f"{company_name}_extraction_log_{timestamp}.docx")
-        generate_extraction_log(extraction_log_entries, log_filepath)
-        print(f"\nTable extraction log saved to: {log_filepath}")
-
-def upload_pdfs_for_chat(gemini_service: GeminiService, pdf_paths: List[str]) -> Dict[str, Any]:
-    """Uploads the selected PDFs to Gemini to be used in the chat."""
+async def upload_pdfs_for_chat(gemini_service: GeminiService, pdf_paths: List[str],
+                               pdf_registry: UploadedPdfRegistry) -> Dict[str, Any]:
+    """
+    Uploads the selected PDFs to Gemini in parallel to be used in the chat.
+    PDFs the registry already has (this session, or from its upload cache) are reused.
+    """
     if not pdf_paths:
         return {}
     
     print(f"\nUploading {len(pdf_paths)} PDF(s) for chat context. This may take a moment...")
     logger.info(f"Attempting to upload {len(pdf_paths)} PDFs for chat.")
-    
+
+    # Cap the number of simultaneous uploads to stay within per-client limits.
+    semaphore = asyncio.Semaphore(settings.UPLOAD_CONCURRENCY)
+
+    async def upload(pdf_path: str):
+        async with semaphore:
+            print(f"  - Uploading {os.path.basename(pdf_path)}...")
+            return await asyncio.to_thread(pdf_registry.get_or_upload, gemini_service, pdf_path)
+
+    results = await asyncio.gather(*(upload(pdf_path) for pdf_path in pdf_paths), return_exceptions=True)
+    pdf_registry.save()
+
     uploaded_files_map = {}
-    for pdf_path in pdf_paths:
+    for pdf_path, result in zip(pdf_paths, results):
         pdf_filename = os.path.basename(pdf_path)
-        print(f"  - Uploading {pdf_filename}...")
-        
-        # The GeminiService's _upload_pdf is abstracted away here.
-        # This function organizes the upload for multiple files.
-        uploaded_file, error = gemini_service._upload_pdf(pdf_path)
-        
+        if isinstance(result, Exception):
+            logger.error(f"Failed to upload {pdf_filename}: {result}", exc_info=result)
+            print(f"  Error uploading {pdf_filename}. It will be excluded from the chat context.")
+            continue
+
+        uploaded_file, error = result
         if error:
             logger.error(f"Failed to upload {pdf_filename}: {error}")
             print(f"  Error uploading {pdf_filename}. It will be excluded from the chat context.")
@@ -370,6 +503,30 @@ def upload_pdfs_for_chat(gemini_service: GeminiService, pdf_paths: List[str]) ->
             
     return uploaded_files_map
 
+def refresh_uploaded_pdfs(gemini_service: GeminiService, pdf_registry: UploadedPdfRegistry,
+                          pdf_paths: List[str], uploaded_files_map: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the chat context for the next turn. Files come from the registry, which
+    only goes back to Gemini when an upload is close to its 48-hour expiry.
+    """
+    refreshed_map = {}
+    for pdf_path in pdf_paths:
+        pdf_filename = os.path.basename(pdf_path)
+        if pdf_filename not in uploaded_files_map:
+            continue
+        uploaded_file, error = pdf_registry.get_or_upload(gemini_service, pdf_path)
+        if uploaded_file:
+            refreshed_map[pdf_filename] = uploaded_file
+        else:
+            logger.error(f"Could not refresh upload of {pdf_filename}, keeping the previous file: {error}")
+            refreshed_map[pdf_filename] = uploaded_files_map[pdf_filename]
+    return refreshed_map
+
+async def _delete_files_concurrently(gemini_service: GeminiService, file_objects: List[Any]):
+    """Deletes uploaded files from Gemini in parallel. Failures are only logged, the files expire anyway."""
+    await asyncio.gather(*(gemini_service._adelete_file(file_obj) for file_obj in file_objects),
+                         return_exceptions=True)
+
 def prompt_for_next_action(has_context: bool) -> str:
     """Asks the user if they want to run preset questions or start chatting."""
     if not has_context:
@@ -404,26 +561,29 @@ def main():
 
     api_key = load_api_key(args.api_key_file)
     if not api_key:
-        log_and_print("API Key not loaded. Exiting.", level=logging.CRITICAL)
+        log_and_print(f"API Key not loaded from '{args.api_key_file}'. Please ensure the file exists in the "
+                      "project's root directory and contains your key. Exiting.", level=logging.CRITICAL)
         return
 
     gemini_service: Optional[GeminiService] = None
     uploaded_pdf_files_map = {}
+    # One registry per session, so each unique PDF is uploaded once and reused by every chat turn.
+    pdf_registry = UploadedPdfRegistry(None if args.no_cache_uploads else UploadCache(settings.UPLOAD_CACHE_FILE))
     chat_history = []
     
     try:
-        gemini_service = GeminiService(api_key=api_key)
+        gemini_service = GeminiService(api_key=api_key, use_extraction_cache=not args.no_extraction_cache)
         
         pdf_files_for_chat = []
         analysis_desc = "General Chat"
 
         if selected_company_name not in ["General_Chat_NoCompany", "Default_Session_NoCompany"]:
-            analysis_choice, pdf_files_for_chat, analysis_desc = select_analysis_pdfs(paths['pdf'], selected_company_name)
+            analysis_choice, pdf_files_for_chat, analysis_desc, all_pdfs_in_folder = select_analysis_pdfs(
+                paths['pdf'], selected_company_name)
             
             if not analysis_choice: # User cancelled selection
                 return
 
-            all_pdfs_in_folder = sorted(glob.glob(os.path.join(paths['pdf'], "*.pdf")))
             selected_pdf = pdf_files_for_chat[0] if analysis_choice == 'single' and pdf_files_for_chat else None
             handle_table_extraction(gemini_service, selected_company_name, all_pdfs_in_folder, 
                                     analysis_choice, selected_pdf, 
@@ -431,7 +591,7 @@ def main():
 
         # Upload PDFs that will be used for the chat session
         if pdf_files_for_chat:
-            uploaded_pdf_files_map = upload_pdfs_for_chat(gemini_service, pdf_files_for_chat)
+            uploaded_pdf_files_map = asyncio.run(upload_pdfs_for_chat(gemini_service, pdf_files_for_chat, pdf_registry))
             if not uploaded_pdf_files_map:
                 print("\nWarning: All PDF uploads failed. Chat will proceed without document context.")
                 logger.warning("All PDF uploads failed. No context for chat.")
@@ -443,6 +603,8 @@ def main():
             return # This will trigger the final block for cleanup
 
         if next_action == 'preset':
+            uploaded_pdf_files_map = refresh_uploaded_pdfs(gemini_service, pdf_registry,
+                                                           pdf_files_for_chat, uploaded_pdf_files_map)
             ask_preset_questions(gemini_service, uploaded_pdf_files_map, chat_history)
             print("-" * 30)
             try:
@@ -481,6 +643,8 @@ def main():
             # This block is where the app communicates with the LLM for a user's custom query.
             # Solid error handling here was crucial for a good user experience.
             try:
+                uploaded_pdf_files_map = refresh_uploaded_pdfs(gemini_service, pdf_registry,
+                                                               pdf_files_for_chat, uploaded_pdf_files_map)
                 llm_response, error_message = gemini_service.generate_chat_response(uploaded_pdf_files_map, user_query)
                 if llm_response:
                     print(f"\nChatbot: {llm_response}")
@@ -516,11 +680,11 @@ def main():
             
             generate_chat_transcript(chat_history, loaded_pdf_names, transcript_filepath)
 
-        if uploaded_pdf_files_map and gemini_service:
+        # Cached uploads are kept on Gemini so the next session can reuse them (they expire after 48 hours).
+        if uploaded_pdf_files_map and gemini_service and args.no_cache_uploads:
             print("\nCleaning up uploaded files...")
             logger.info(f"Cleaning up {len(uploaded_pdf_files_map)} files from service.")
-            for filename, file_obj in uploaded_pdf_files_map.items():
-                gemini_service._delete_file(file_obj)
+            asyncio.run(_delete_files_concurrently(gemini_service, list(uploaded_pdf_files_map.values())))
             print("Cleanup complete.")
 
         print("\nThank you for using the Financial Chatbot. Goodbye!")
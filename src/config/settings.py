@@ -1,6 +1,8 @@
 """
 Configuration settings for the chatbot application.
 """
+import os
+import re
 
 # Gemini model for all API calls
 MODEL_NAME = "gemini-2.5-pro-preview-05-06"
@@ -12,6 +14,10 @@ TARGET_TABLES = [
     "CONSOLIDATED BALANCE SHEETS"
 ]
 
+# Excel sheet names for the target tables: only letters, digits, spaces and
+# underscores, and at most 31 characters.
+TARGET_TABLE_SAFE_NAMES = {table: re.sub(r'[^\w ]', '', table).strip()[:31] for table in TARGET_TABLES}
+
 # Examplary preset questions for the chatbot
 PRESET_FINANCIAL_QUESTIONS = {
     "Liability Overview": [
@@ -31,8 +37,28 @@ PRESET_FINANCIAL_QUESTIONS = {
     ]
 }
 
+# Client-side rate limits for Gemini calls (requests and tokens per minute).
+# These match the free-tier quota; raise them if your API key has a higher tier.
+REQUESTS_PER_MINUTE = 5
+TOKENS_PER_MINUTE = 250_000
+
+# Maximum number of preset questions sent to Gemini at the same time
+PRESET_QUESTION_CONCURRENCY = 5
+
+# Maximum number of PDFs uploaded to Gemini at the same time
+UPLOAD_CONCURRENCY = 4
+
+# Maximum number of PDFs processed for table extraction at the same time
+EXTRACTION_CONCURRENCY = 4
+
 # Default folder names
 PDF_FOLDER = "fin_statements"
 EXCEL_OUTPUT_FOLDER = "output/excel_reports"
 LOG_OUTPUT_FOLDER = "output/logs_and_transcripts"
-API_KEY_FILE = "api_key.txt" 
\ No newline at end of file
+API_KEY_FILE = "api_key.txt" 
+
+# Local cache locations: the index of PDFs already uploaded to Gemini (reused
+# across sessions) and previously extracted tables.
+CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".cache", "fin_chatbot")
+UPLOAD_CACHE_FILE = os.path.join(CACHE_FOLDER, "upload_index.json")
+EXTRACTION_CACHE_FOLDER = os.path.join(CACHE_FOLDER, "extractions")
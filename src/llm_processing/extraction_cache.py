@@ -0,0 +1,72 @@
+"""
+On-disk cache for table extraction results.
+
+Extracting tables means uploading the PDF and waiting for a long Gemini call,
+so results are stored per PDF and reused when the same file is processed
+again. The cache key covers the PDF contents, the model, the prompt version
+and the requested tables, so changing any of them causes a fresh extraction.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class ExtractionCache:
+    """Stores validated extraction results as <cache_dir>/<key>.json."""
+    def __init__(self, cache_dir: str, model_name: str, prompt_version: str):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.prompt_version = prompt_version
+        # Hash state after reading a PDF, so get() and set() for the same file only read it once.
+        self._pdf_hashes: Dict[Tuple[str, int, int], Any] = {}
+
+    def _pdf_hash(self, pdf_path: str):
+        """Hashes the PDF contents, prefixed with their length, reading 1 MiB at a time."""
+        stat = os.stat(pdf_path)
+        memo_key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self._pdf_hashes:
+            digest = hashlib.sha256(stat.st_size.to_bytes(8, 'little'))
+            with open(pdf_path, 'rb') as f:
+                while chunk := f.read(1 << 20):
+                    digest.update(chunk)
+            self._pdf_hashes[memo_key] = digest
+        return self._pdf_hashes[memo_key].copy()
+
+    def _key(self, pdf_path: str, target_tables: List[str]) -> str:
+        digest = self._pdf_hash(pdf_path)
+        digest.update(b'|' + self.model_name.encode())
+        digest.update(b'|' + self.prompt_version.encode())
+        digest.update(b'|' + json.dumps(sorted(target_tables)).encode())
+        return digest.hexdigest()
+
+    def _path(self, pdf_path: str, target_tables: List[str]) -> str:
+        return os.path.join(self.cache_dir, f"{self._key(pdf_path, target_tables)}.json")
+
+    def get(self, pdf_path: str, target_tables: List[str]) -> Optional[Dict[str, List[List[Any]]]]:
+        """Returns the cached extraction for this PDF and table list, or None on a miss."""
+        try:
+            cache_path = self._path(pdf_path, target_tables)
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            logger.info(f"Using cached table extraction for {pdf_path} ({cache_path}).")
+            return result
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable extraction cache entry for {pdf_path}: {e}")
+            return None
+
+    def set(self, pdf_path: str, target_tables: List[str], result: Dict[str, List[List[Any]]]):
+        """Stores an extraction result. Written to a temporary file first so readers never see partial JSON."""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            cache_path = self._path(pdf_path, target_tables)
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.error(f"Failed to write extraction cache entry for {pdf_path}: {e}")
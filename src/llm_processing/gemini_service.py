@@ -2,79 +2,53 @@
 Handles all communication with the Google Gemini API.
 """
 import google.generativeai as genai
+import asyncio
+import contextlib
+import functools
 import logging
 import json
+import string
 import time
-from typing import List, Dict, Any, Tuple
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, List, Dict, Any, Tuple
 import os
 
-from src.config.settings import MODEL_NAME
+try:
+    import orjson  # Optional: faster parsing of extraction responses when ijson is not installed.
+except ImportError:
+    orjson = None
+try:
+    import ijson  # Optional: parses the streamed extraction response while it is still arriving.
+except ImportError:
+    ijson = None
+try:
+    from tqdm import tqdm  # Optional: progress bar for batch table extraction.
+    from tqdm.contrib.logging import logging_redirect_tqdm
+except ImportError:
+    tqdm = None
 
-logger = logging.getLogger(__name__)
+from src.config.settings import MODEL_NAME, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, EXTRACTION_CACHE_FOLDER
+from src.llm_processing.extraction_cache import ExtractionCache
+from src.utils.rate_limit import (AsyncLimiter, backoff_delays, is_transient_error,
+                                  retry_on_transient_error, aretry_on_transient_error)
 
-class GeminiService:
-    """A service class for all Gemini API interactions."""
-    def __init__(self, api_key: str):
-        """Sets up the Gemini API with the provided key."""
-        try:
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel(MODEL_NAME)
-            logger.info(f"GeminiService initialized with model: {MODEL_NAME}")
-        except Exception as e:
-            logger.error(f"Failed to configure Gemini API: {e}", exc_info=True)
-            raise ValueError(f"Failed to configure Gemini API. Please check your API key and permissions.")
+logger = logging.getLogger(__name__)
 
-    def _upload_pdf(self, pdf_path: str) -> Tuple[genai.types.File | None, str | None]:
-        """Uploads a PDF to Gemini and waits for it to be processed."""
-        logger.info(f"Uploading PDF: {pdf_path}...")
-        try:
-            uploaded_file = genai.upload_file(path=pdf_path, display_name=os.path.basename(pdf_path))
-            logger.info(f"Successfully started upload for '{pdf_path}' as '{uploaded_file.name}'.")
+# Gemini counts each PDF page as 258 tokens. Page counts are not known before sending, so they are
+# estimated from the file size (text-heavy financial statements average roughly 30 KB per page).
+PDF_TOKENS_PER_PAGE = 258
+PDF_BYTES_PER_PAGE_ESTIMATE = 30_000
 
-            # Wait for the file to finish processing.
-            while uploaded_file.state.name == "PROCESSING":
-                time.sleep(2)
-                uploaded_file = genai.get_file(name=uploaded_file.name)
-                logger.debug(f"File '{uploaded_file.name}' state: {uploaded_file.state.name}")
+# Bump this whenever the table extraction prompt changes, so cached extractions are not reused.
+PROMPT_VERSION = "v1"
 
-            if uploaded_file.state.name == "FAILED":
-                error_msg = f"File upload failed for {pdf_path}."
-                logger.error(error_msg)
-                return None, error_msg
-            
-            logger.info(f"Successfully uploaded file '{pdf_path}' ({uploaded_file.name}).")
-            return uploaded_file, None
-        except Exception as e:
-            error_msg = f"An unexpected error occurred during PDF upload for {pdf_path}: {e}"
-            logger.error(error_msg, exc_info=True)
-            return None, error_msg
-    
-    def _delete_file(self, file_object: genai.types.File):
-        """Deletes a file from Gemini."""
-        if not file_object:
-            return
-        try:
-            genai.delete_file(name=file_object.name)
-            logger.info(f"Successfully deleted uploaded file: {file_object.name}")
-        except Exception as e:
-            logger.error(f"Failed to delete uploaded file {file_object.name}: {e}", exc_info=True)
-
-    def extract_tables_from_pdf(self, pdf_path: str, target_tables: List[str]) -> Tuple[Dict[str, List[List[Any]]] | None, str | None]:
-        """Extracts key financial tables from a PDF using a specific prompt."""
-        logger.info(f"Attempting to extract tables: {', '.join(target_tables)} from PDF: {pdf_path}")
-        uploaded_file = None
-        try:
-            uploaded_file, error = self._upload_pdf(pdf_path)
-            if error:
-                return None, error
-            
-            # This prompt guides the AI to extract specific tables and return them as JSON.
-            prompt = f"""
+# This prompt guides the AI to extract specific tables and return them as JSON.
+TABLE_EXTRACTION_PROMPT_TEMPLATE = string.Template("""
             You are an expert financial data analyst specializing in extracting information from corporate financial statements.
-            Analyze the provided PDF document: "{uploaded_file.display_name}".
+            Analyze the provided PDF document: "${display_name}".
 
             Your task is to identify and extract the full content of the following tables:
-            {', '.join([f'"{name}"' for name in target_tables])}
+            ${target_table_names}
 
             Important Instructions:
             1.  For each target table, extract all rows and columns accurately.
@@ -86,85 +60,35 @@ class GeminiService:
             7.  The JSON object should have keys corresponding to each of the target table names listed above.
             8.  The value for each key should be the extracted table data, represented as a list of lists, where the first inner list contains the header row, and subsequent inner lists contain the data rows.
             9.  If a specific target table is not found in the document, its key should still be present in the JSON, but its value should be an empty list or a list containing a single row like [["Table Not Found"]].
-            10. Ensure all numerical values are extracted as strings to preserve formatting (e.g., "$1,234.56", "(789)"). Do not convert them to numbers yet.
+            10. Ensure all numerical values are extracted as strings to preserve formatting (e.g., "$$1,234.56", "(789)"). Do not convert them to numbers yet.
             11. Pay close attention to the exact wording of the table titles.
 
             Example of expected JSON structure for one table:
-            {{
+            {
               "CONSOLIDATED STATEMENTS OF OPERATIONS": [
                 ["Revenue", "2023", "2022"],
-                ["Product Sales", "$1,000,000", "$900,000"],
-                ["Service Revenue", "$500,000", "$450,000"],
-                ["Total Revenue", "$1,500,000", "$1,350,000"],
-                ["Cost of Revenue", "($800,000)", "($700,000)"],
-                ["Gross Profit", "$700,000", "$650,000"]
+                ["Product Sales", "$$1,000,000", "$$900,000"],
+                ["Service Revenue", "$$500,000", "$$450,000"],
+                ["Total Revenue", "$$1,500,000", "$$1,350,000"],
+                ["Cost of Revenue", "($$800,000)", "($$700,000)"],
+                ["Gross Profit", "$$700,000", "$$650,000"]
               ],
               "CONSOLIDATED BALANCE SHEETS": [
                 ["Table Not Found"] 
               ]
               // ... other tables
-            }}
-            """
-            
-            response = self.model.generate_content([prompt, uploaded_file],
-                                                   generation_config=genai.types.GenerationConfig(
-                                                       response_mime_type="application/json"))
-            
-            logger.debug(f"Raw LLM response for table extraction from {pdf_path}: {response.text[:500]}...")
-            
-            # The JSON parsing is implemented in case the AI's output isn't perfect.
-            try:
-                extracted_data = json.loads(response.text)
-                # Validate structure
-                validated_data = {}
-                for table_name in target_tables:
-                    if table_name in extracted_data and isinstance(extracted_data[table_name], list):
-                        # Basic check: if not empty, first element should be a list (header)
-                        if not extracted_data[table_name] or isinstance(extracted_data[table_name][0], list):
-                             validated_data[table_name] = extracted_data[table_name]
-                        else: # Malformed table data
-                            logger.warning(f"Table '{table_name}' from {pdf_path} has malformed data (expected list of lists). Assigning 'Table Not Found'.")
-                            validated_data[table_name] = [["Table Data Malformed by LLM"]]
-                    else:
-                        logger.warning(f"Target table '{table_name}' not found or not a list in LLM response for {pdf_path}. Assigning 'Table Not Found'.")
-                        validated_data[table_name] = [["Table Not Found in LLM Response"]]
-                
-                logger.info(f"Successfully extracted and parsed tables from {pdf_path}.")
-                return validated_data, None
-            except json.JSONDecodeError as je:
-                error_msg = f"Failed to parse JSON response from LLM for {pdf_path}: {je}. Response text: {response.text[:500]}"
-                logger.error(error_msg)
-                return None, error_msg
-            except Exception as e:
-                error_msg = f"An unexpected error occurred during table data processing for {pdf_path}: {e}"
-                logger.error(error_msg)
-                return None, error_msg
+            }
+            """)
 
-        except Exception as e:
-            error_msg = f"An error occurred during table extraction for {pdf_path}: {e}"
-            logger.error(error_msg, exc_info=True)
-            return None, error_msg
-        finally:
-            if uploaded_file:
-                self._delete_file(uploaded_file)
-    
-    def generate_chat_response(self, uploaded_pdf_files: Dict[str, Any], user_query: str) -> Tuple[str | None, str | None]:
-        """Sends the user's question and the PDF context to Gemini to get a response."""
-        if not uploaded_pdf_files:
-            error_msg = "No PDF files provided for context."
-            logger.warning(error_msg)
-            return "I don't have any documents loaded to answer your question. Please load a document first.", error_msg
-        
-        logger.info(f"Generating chat response for query: '{user_query}' using {len(uploaded_pdf_files)} PDF(s).")
-        
-        # This detailed prompt is crucial for getting good, well-cited answers from the AI.
-        pdf_references = "\n".join([f'- "{filename}" (File ID: {file_obj.name})' for filename, file_obj in uploaded_pdf_files.items()])
-        
-        prompt_parts = [
-            f"""You are an expert financial analyst assistant. Your knowledge is strictly limited to the content of the following PDF document(s):
-            {pdf_references}
+# Sent along with the extraction prompt when the previous answer was not valid JSON.
+JSON_RETRY_PROMPT_TEMPLATE = string.Template(
+    "Your previous output failed JSON validation with error: ${error}. Return valid JSON.")
+
+# This detailed prompt is crucial for getting good, well-cited answers from the AI.
+CHAT_PROMPT_TEMPLATE = string.Template("""You are an expert financial analyst assistant. Your knowledge is strictly limited to the content of the following PDF document(s):
+            ${pdf_references}
 
-            A user has asked the following question: "{user_query}"
+            A user has asked the following question: "${user_query}"
 
             Your main task is to provide a comprehensive summary of the information found throughout the *entire content* of the referenced PDF document(s) that directly answers the user's question. This includes information from narrative text, discussions, tables, and any other relevant sections. Do not limit your search to just tables.
             
@@ -172,7 +96,7 @@ class GeminiService:
             1.  **Conciseness and Clarity:** Provide a concise and straightforward answer. Get directly to the point while still being comprehensive. Avoid unnecessary jargon or overly lengthy explanations if a simpler one suffices.
             2.  **Structured Output:** Please structure your response clearly. You can use the following format as a guideline:
                 *   `**Key Findings:**`
-                    *   `If the user's query specifically asks for one or more numerical values (e.g., "What is the total debt?", "What are the total assets and revenue?"), this section should present *only* those numerical values as directly and concisely as possible. For example: "Total Debt: $1,234,567" or "Total Assets: $2,500,000; Total Revenue: $800,000". Include currency symbols or units where appropriate as found in the document.`
+                    *   `If the user's query specifically asks for one or more numerical values (e.g., "What is the total debt?", "What are the total assets and revenue?"), this section should present *only* those numerical values as directly and concisely as possible. For example: "Total Debt: $$1,234,567" or "Total Assets: $$2,500,000; Total Revenue: $$800,000". Include currency symbols or units where appropriate as found in the document.`
                     *   `If the query is more general or asks for a non-numerical summary, provide a brief, direct textual answer or summary here.`
                     *   `If the requested numerical value(s) or information is not found after a thorough review, state this clearly here (e.g., "The total debt figure is not specified in the provided document(s).").`
                 *   `**Details:**` `[This section, should provide more specific information, context, breakdowns (e.g., components of a total figure presented in Key Findings, such as types of debt), data points, or explanations supporting or elaborating on the Key Findings. Use bullet points for lists if appropriate.]`
@@ -198,18 +122,532 @@ class GeminiService:
             8.  Provide a clear, concise, and well-summarized answer, following the structure outlined.
             9.  If the user's query is ambiguous, you can ask for clarification, but first attempt to provide a helpful summary based on a reasonable interpretation of the full document context, keeping in mind the broad interpretation of financial terms and the requested output structure.
             10. For complex queries, break down your answer logically, possibly using sub-headings (e.g., `***Sub-Topic***`) within the "**Details**" section.
-            """
-        ]
+            """)
+
+@functools.lru_cache(maxsize=None)
+def _quoted_table_names(target_tables: Tuple[str, ...]) -> str:
+    """Formats the target table names for the extraction prompt, e.g. '"A", "B"'."""
+    return ", ".join(f'"{name}"' for name in target_tables)
+
+def _loads_json(text: str) -> Any:
+    """
+    Parses JSON with orjson if it is installed. Its errors subclass json.JSONDecodeError.
+    Only used for extraction responses when ijson is not installed; with ijson they are parsed while streaming.
+    """
+    if orjson is None:
+        return json.loads(text)
+    return orjson.loads(text)
+
+def _poll_delays(initial: float = 0.25, factor: float = 1.6, cap: float = 2.0) -> Iterator[float]:
+    """Exponentially growing waits between file status checks."""
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * factor, cap)
+
+def _table_extraction_schema(target_tables: Tuple[str, ...]) -> Dict[str, Any]:
+    """Builds the structured-output schema: one key per target table, each a list of rows of strings."""
+    table_schema = {"type": "array", "items": {"type": "array", "items": {"type": "string"}}}
+    return {
+        "type": "object",
+        "properties": {table_name: table_schema for table_name in target_tables},
+        "required": list(target_tables),
+    }
+
+@functools.lru_cache(maxsize=None)
+def _table_extraction_config(target_tables: Tuple[str, ...]) -> genai.types.GenerationConfig:
+    """The JSON generation config for a set of target tables, built once and shared by every extraction."""
+    return genai.types.GenerationConfig(response_mime_type="application/json",
+                                        response_schema=_table_extraction_schema(target_tables))
+
+# Errors raised for invalid JSON by whichever parser is in use.
+_JSON_ERRORS = (json.JSONDecodeError, ijson.JSONError) if ijson else (json.JSONDecodeError,)
+
+def _iter_response_text(response: Any) -> Iterator[str]:
+    """
+    Yields the non-empty text of each chunk of a streamed generate_content response. Chunks without
+    candidates (e.g. a final one carrying only usage metadata) or without text are skipped, since
+    ijson treats empty input as the end of the document.
+    """
+    for chunk in response:
+        candidates = chunk.candidates
+        if not candidates:
+            prompt_feedback = getattr(chunk, 'prompt_feedback', None)
+            if prompt_feedback and prompt_feedback.block_reason:
+                raise ValueError(f"The prompt was blocked by Gemini: {prompt_feedback}")
+            continue
+        text = "".join(part.text for part in candidates[0].content.parts)
+        if text:
+            yield text
+
+def _full_response_text(response: Any) -> str:
+    """The complete text of a streamed response, reading any chunks the parser stopped before. Empty if unavailable."""
+    try:
+        response.resolve()
+        return response.text
+    except Exception:
+        return ""
+
+def _response_preview(response: Any, limit: int = 500) -> str:
+    """The start of a response's text for logs. A stream that failed part way has no final text yet."""
+    try:
+        return response.text[:limit]
+    except Exception:
+        return "<incomplete streamed response>"
+
+def _validate_one(table_name: str, table_data: Any, pdf_path: str) -> List[List[Any]]:
+    """Returns the table rows if they look like a list of lists, otherwise a placeholder row explaining why not."""
+    if not isinstance(table_data, list):
+        logger.warning(f"Target table '{table_name}' not found or not a list in LLM response for {pdf_path}. Assigning 'Table Not Found'.")
+        return [["Table Not Found in LLM Response"]]
+    # Basic check: if not empty, first element should be a list (header)
+    if table_data and not isinstance(table_data[0], list):
+        logger.warning(f"Table '{table_name}' from {pdf_path} has malformed data (expected list of lists). Assigning 'Table Not Found'.")
+        return [["Table Data Malformed by LLM"]]
+    return table_data
+
+# Rows that stand in for a table the LLM did not return properly.
+_PLACEHOLDER_TABLES = (
+    [["Table Not Found"]],
+    [["Table Not Found in LLM Response"]],
+    [["Table Data Malformed by LLM"]],
+)
+
+def _has_extracted_tables(extracted_data: Dict[str, List[List[Any]]] | None) -> bool:
+    """
+    Checks whether at least one table was actually extracted. Results made only of placeholders
+    are not cached, so a flaky answer is retried on the next run instead of being replayed.
+    """
+    return bool(extracted_data) and any(
+        table_data and table_data not in _PLACEHOLDER_TABLES for table_data in extracted_data.values())
+
+class GeminiService:
+    """A service class for all Gemini API interactions."""
+    def __init__(self, api_key: str, use_extraction_cache: bool = True):
+        """
+        Sets up the Gemini API with the provided key. The model itself is created on first use.
+        With use_extraction_cache=False, cached table extractions are ignored and replaced by fresh ones.
+        """
+        try:
+            genai.configure(api_key=api_key)
+            self.rate_limiter = AsyncLimiter(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)
+            self.extraction_cache = ExtractionCache(EXTRACTION_CACHE_FOLDER, MODEL_NAME, PROMPT_VERSION)
+            self.use_extraction_cache = use_extraction_cache
+            # URI references to uploaded files, built once per file and reused by every chat turn.
+            self._file_parts: Dict[Tuple[str, str], Dict[str, Any]] = {}
+            # Estimated prompt tokens of each uploaded file, by URI, for the tokens-per-minute limit.
+            self._file_tokens: Dict[str, int] = {}
+            logger.info(f"GeminiService initialized with model: {MODEL_NAME}")
+        except Exception as e:
+            logger.error(f"Failed to configure Gemini API: {e}", exc_info=True)
+            raise ValueError(f"Failed to configure Gemini API. Please check your API key and permissions.")
+
+    @functools.cached_property
+    def model(self) -> genai.GenerativeModel:
+        """The Gemini model, created the first time a request is made so sessions that never call the LLM skip it."""
+        return genai.GenerativeModel(MODEL_NAME)
+
+    def _estimate_tokens(self, contents: List[Any]) -> int:
+        """
+        Roughly estimates the prompt tokens of a request: about 4 characters per token for
+        text, plus an estimate for every attached PDF, which usually makes up most of it.
+        """
+        # Multi-turn contents are {"role": ..., "parts": [...]} messages; count the parts of each.
+        parts = [part for item in contents
+                 for part in (item.get("parts", []) if isinstance(item, dict) and "parts" in item else [item])]
+        tokens = 0
+        for part in parts:
+            if isinstance(part, str):
+                tokens += len(part) // 4
+            elif isinstance(part, dict) and "file_data" in part:
+                tokens += self._file_tokens.get(part["file_data"]["file_uri"], PDF_TOKENS_PER_PAGE)
+            else:
+                tokens += self._pdf_token_estimate(part)
+        return tokens
+
+    def _pdf_token_estimate(self, file_obj: Any) -> int:
+        """Estimates an uploaded PDF's tokens from its size, as Gemini counts a fixed number of tokens per page."""
+        size_bytes = getattr(file_obj, 'size_bytes', None) or 0
+        pages = max(1, -(-size_bytes // PDF_BYTES_PER_PAGE_ESTIMATE))
+        tokens = pages * PDF_TOKENS_PER_PAGE
+        uri = getattr(file_obj, 'uri', None)
+        if uri:
+            self._file_tokens[uri] = tokens
+        return tokens
+
+    def _call_with_retry(self, contents: List[Any], *, max_attempts: int = 3, base_delay: float = 1.0, **kwargs) -> Any:
+        """
+        Calls generate_content within the rate limit. Transient errors (quota or 5xx) are retried
+        with exponential backoff, so one hiccup does not cost a whole re-upload and re-run.
+        """
+        est_tokens = self._estimate_tokens(contents)
+
+        def send():
+            with self.rate_limiter.acquire_blocking(est_tokens):
+                return self.model.generate_content(contents, **kwargs)
+
+        return retry_on_transient_error(send, max_attempts, base_delay)
+
+    async def _acall_with_retry(self, contents: List[Any], *, max_attempts: int = 3, base_delay: float = 1.0, **kwargs) -> Any:
+        """Async variant of _call_with_retry."""
+        est_tokens = self._estimate_tokens(contents)
+
+        async def send():
+            async with self.rate_limiter.acquire(est_tokens):
+                return await self.model.generate_content_async(contents, **kwargs)
+
+        return await aretry_on_transient_error(send, max_attempts, base_delay)
+
+    def _start_upload(self, pdf_path: str) -> genai.types.File:
+        """Sends a PDF to Gemini. The returned file may still be PROCESSING."""
+        # Pass the path (never the file's bytes) so the SDK's resumable upload reads the PDF
+        # from disk itself instead of us holding every selected PDF in memory.
+        uploaded_file = genai.upload_file(path=pdf_path, mime_type="application/pdf",
+                                          display_name=os.path.basename(pdf_path), resumable=True)
+        logger.info(f"Successfully started upload for '{pdf_path}' as '{uploaded_file.name}'.")
+        return uploaded_file
+
+    @staticmethod
+    def _check_processed_file(uploaded_file: genai.types.File, pdf_path: str) -> Tuple[genai.types.File | None, str | None]:
+        """Turns a file that finished processing into the (file, error) result of an upload."""
+        if uploaded_file.state.name == "FAILED":
+            error_msg = f"File upload failed for {pdf_path}."
+            logger.error(error_msg)
+            return None, error_msg
+
+        logger.info(f"Successfully uploaded file '{pdf_path}' ({uploaded_file.name}).")
+        return uploaded_file, None
+
+    def _processing_timed_out(self, uploaded_file: genai.types.File, pdf_path: str,
+                              max_wait_seconds: float) -> Tuple[None, str]:
+        """Gives up on a file that is stuck in PROCESSING and removes it from Gemini."""
+        error_msg = f"Gemini did not finish processing {pdf_path} within {max_wait_seconds:.0f} seconds."
+        logger.error(error_msg)
+        self._delete_file(uploaded_file)
+        return None, error_msg
+
+    def _upload_pdf(self, pdf_path: str, max_wait_seconds: float = 120) -> Tuple[genai.types.File | None, str | None]:
+        """Uploads a PDF to Gemini and waits (at most max_wait_seconds) for it to be processed."""
+        logger.info(f"Uploading PDF: {pdf_path}...")
+        try:
+            uploaded_file = self._start_upload(pdf_path)
+
+            # Wait for the file to finish processing, checking often at first since small files are quick.
+            deadline = time.monotonic() + max_wait_seconds
+            delays = _poll_delays()
+            while uploaded_file.state.name == "PROCESSING":
+                if time.monotonic() >= deadline:
+                    return self._processing_timed_out(uploaded_file, pdf_path, max_wait_seconds)
+                time.sleep(next(delays))
+                uploaded_file = genai.get_file(name=uploaded_file.name)
+                logger.debug(f"File '{uploaded_file.name}' state: {uploaded_file.state.name}")
+
+            return self._check_processed_file(uploaded_file, pdf_path)
+        except Exception as e:
+            error_msg = f"An unexpected error occurred during PDF upload for {pdf_path}: {e}"
+            logger.error(error_msg, exc_info=True)
+            return None, error_msg
+    
+    async def _aupload_pdf(self, pdf_path: str, executor: Executor | None = None,
+                           max_wait_seconds: float = 120) -> Tuple[genai.types.File | None, str | None]:
+        """
+        Async variant of _upload_pdf. The blocking SDK calls run in the executor, while the
+        wait between status checks is an asyncio.sleep, so many files can be PROCESSING at
+        once without tying up a thread each.
+        """
+        logger.info(f"Uploading PDF: {pdf_path}...")
+        loop = asyncio.get_running_loop()
+        try:
+            uploaded_file = await loop.run_in_executor(executor, self._start_upload, pdf_path)
+
+            deadline = loop.time() + max_wait_seconds
+            delays = _poll_delays()
+            while uploaded_file.state.name == "PROCESSING":
+                if loop.time() >= deadline:
+                    return await loop.run_in_executor(
+                        executor, self._processing_timed_out, uploaded_file, pdf_path, max_wait_seconds)
+                await asyncio.sleep(next(delays))
+                uploaded_file = await loop.run_in_executor(executor, functools.partial(genai.get_file, name=uploaded_file.name))
+                logger.debug(f"File '{uploaded_file.name}' state: {uploaded_file.state.name}")
+
+            return self._check_processed_file(uploaded_file, pdf_path)
+        except Exception as e:
+            error_msg = f"An unexpected error occurred during PDF upload for {pdf_path}: {e}"
+            logger.error(error_msg, exc_info=True)
+            return None, error_msg
+
+    def _get_active_file(self, file_name: str) -> genai.types.File | None:
+        """Returns a previously uploaded file if Gemini still has it and it is ready to use."""
+        try:
+            uploaded_file = genai.get_file(name=file_name)
+        except Exception as e:
+            logger.info(f"Previously uploaded file {file_name} is no longer available: {e}")
+            return None
+        return uploaded_file if uploaded_file.state.name == "ACTIVE" else None
+
+    def _delete_file(self, file_object: genai.types.File):
+        """Deletes a file from Gemini."""
+        if not file_object:
+            return
+        try:
+            genai.delete_file(name=file_object.name)
+            logger.info(f"Successfully deleted uploaded file: {file_object.name}")
+        except Exception as e:
+            logger.error(f"Failed to delete uploaded file {file_object.name}: {e}", exc_info=True)
+
+    async def _adelete_file(self, file_object: genai.types.File):
+        """Async variant of _delete_file, so several files can be deleted at once."""
+        await asyncio.to_thread(self._delete_file, file_object)
+
+    def extract_tables_from_pdf(self, pdf_path: str, target_tables: List[str]) -> Tuple[Dict[str, List[List[Any]]] | None, str | None]:
+        """Extracts key financial tables from a PDF using a specific prompt."""
+        logger.info(f"Attempting to extract tables: {', '.join(target_tables)} from PDF: {pdf_path}")
+        cached = self.extraction_cache.get(pdf_path, target_tables) if self.use_extraction_cache else None
+        if cached is not None:
+            return cached, None
+
+        uploaded_file = None
+        try:
+            uploaded_file, error = self._upload_pdf(pdf_path)
+            if error:
+                return None, error
+            extracted_data, error = self._extract_tables_from_file(uploaded_file, pdf_path, target_tables)
+            if _has_extracted_tables(extracted_data):
+                self.extraction_cache.set(pdf_path, target_tables, extracted_data)
+            return extracted_data, error
+        finally:
+            if uploaded_file:
+                self._delete_file(uploaded_file)
+
+    def _extract_tables_from_file(self, uploaded_file: genai.types.File, pdf_path: str, target_tables: List[str],
+                                  max_attempts: int = 3, base_delay: float = 1.0
+                                  ) -> Tuple[Dict[str, List[List[Any]]] | None, str | None]:
+        """
+        Runs the table extraction prompt against a PDF that is already uploaded, making at most
+        max_attempts requests. If the answer is not valid JSON, the model is shown its previous
+        output and the parse error and asked to correct it. Transient errors, including a stream
+        that breaks off, are retried with backoff. Both reuse the same upload.
+        """
+        try:
+            table_key = tuple(target_tables)
+            prompt = TABLE_EXTRACTION_PROMPT_TEMPLATE.substitute(
+                display_name=uploaded_file.display_name,
+                target_table_names=_quoted_table_names(table_key))
+            contents: List[Any] = [prompt, uploaded_file]
+            delays = backoff_delays(base_delay)
+            
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    # All target tables come back from this single request. The response schema makes Gemini
+                    # return exactly one key per table holding rows of strings. The response is streamed so
+                    # tables can be parsed while the rest of the JSON is still being generated.
+                    # Retries are handled by this loop, so the call itself is attempted once.
+                    response = self._call_with_retry(contents, max_attempts=1, stream=True,
+                                                     generation_config=_table_extraction_config(table_key))
+                    
+                    # The JSON parsing is implemented in case the AI's output isn't perfect.
+                    validated_data = self._parse_streamed_tables(response, target_tables, pdf_path)
+                    logger.debug(f"Raw LLM response for table extraction from {pdf_path}: {_response_preview(response)}...")
+                    logger.info(f"Successfully extracted and parsed tables from {pdf_path}.")
+                    return validated_data, None
+                except _JSON_ERRORS as je:
+                    previous_output = _full_response_text(response)
+                    error_msg = f"Failed to parse JSON response from LLM for {pdf_path}: {je}. Response text: {previous_output[:500]}"
+                    if attempt == max_attempts:
+                        logger.error(error_msg)
+                        return None, error_msg
+                    logger.warning(f"{error_msg} Asking the model to correct it (attempt {attempt}/{max_attempts}).")
+                    # Continue as a conversation, so the model sees the output it is asked to fix.
+                    contents = [
+                        {"role": "user", "parts": [prompt, uploaded_file]},
+                        {"role": "model", "parts": [previous_output]},
+                        {"role": "user", "parts": [JSON_RETRY_PROMPT_TEMPLATE.substitute(error=je)]},
+                    ]
+                except Exception as e:
+                    if attempt == max_attempts or not is_transient_error(e):
+                        raise
+                    delay = next(delays)
+                    logger.warning(f"Transient Gemini error during table extraction for {pdf_path} "
+                                   f"(attempt {attempt}/{max_attempts}): {e}. Retrying in {delay:.0f}s.")
+                    time.sleep(delay)
+
+        except Exception as e:
+            error_msg = f"An error occurred during table extraction for {pdf_path}: {e}"
+            logger.error(error_msg, exc_info=True)
+            return None, error_msg
+    
+    @staticmethod
+    def _parse_streamed_tables(response: Any, target_tables: List[str], pdf_path: str) -> Dict[str, List[List[Any]]]:
+        """
+        Parses a streamed extraction response into validated tables. With ijson installed, each
+        top-level table is validated as soon as its JSON is complete; otherwise the chunks are
+        joined and parsed at the end. Tables missing from the response get a placeholder row.
+        """
+        wanted = set(target_tables)
+        validated_data: Dict[str, List[List[Any]]] = {}
+
+        if ijson:
+            # use_float keeps any numbers JSON-serializable for the extraction cache (no Decimals).
+            events = ijson.sendable_list()
+            parser = ijson.kvitems_coro(events, '', use_float=True)
+            for text in _iter_response_text(response):
+                parser.send(text.encode('utf-8'))
+                for table_name, table_data in events:
+                    if table_name in wanted:
+                        validated_data[table_name] = _validate_one(table_name, table_data, pdf_path)
+                del events[:]
+            parser.close()
+            for table_name, table_data in events:
+                if table_name in wanted:
+                    validated_data[table_name] = _validate_one(table_name, table_data, pdf_path)
+        else:
+            extracted_data = _loads_json("".join(_iter_response_text(response)))
+            if not isinstance(extracted_data, dict):
+                logger.warning(f"LLM response for {pdf_path} is not a JSON object. Assigning 'Table Not Found' to all tables.")
+                extracted_data = {}
+            validated_data = {table_name: _validate_one(table_name, extracted_data[table_name], pdf_path)
+                              for table_name in target_tables if table_name in extracted_data}
+
+        # Tables the response never mentioned.
+        return {table_name: validated_data[table_name] if table_name in validated_data
+                else _validate_one(table_name, None, pdf_path)
+                for table_name in target_tables}
+
+    async def aextract_tables_from_pdf(self, pdf_path: str, target_tables: List[str],
+                                       executor: Executor | None = None) -> Tuple[Dict[str, List[List[Any]]] | None, str | None]:
+        """Async variant of extract_tables_from_pdf, so several PDFs can be processed at once."""
+        logger.info(f"Attempting to extract tables: {', '.join(target_tables)} from PDF: {pdf_path}")
+        loop = asyncio.get_running_loop()
+        cached = None
+        if self.use_extraction_cache:
+            cached = await loop.run_in_executor(executor, self.extraction_cache.get, pdf_path, target_tables)
+        if cached is not None:
+            return cached, None
+
+        uploaded_file = None
+        try:
+            uploaded_file, error = await self._aupload_pdf(pdf_path, executor)
+            if error:
+                return None, error
+            extracted_data, error = await loop.run_in_executor(
+                executor, self._extract_tables_from_file, uploaded_file, pdf_path, target_tables)
+            if _has_extracted_tables(extracted_data):
+                await loop.run_in_executor(executor, self.extraction_cache.set, pdf_path, target_tables, extracted_data)
+            return extracted_data, error
+        finally:
+            if uploaded_file:
+                await loop.run_in_executor(executor, self._delete_file, uploaded_file)
+
+    async def aextract_tables_from_pdfs(self, pdf_paths: List[str], target_tables: List[str], max_concurrency: int = 8,
+                                        show_progress: bool = False
+                                        ) -> AsyncIterator[Tuple[str, Dict[str, List[List[Any]]] | None, str | None, float]]:
+        """
+        Extracts tables from several PDFs at once, at most max_concurrency at a time.
+        Yields (pdf_path, tables, error, seconds taken) for each PDF as soon as it is done.
+        With show_progress, a tqdm progress bar (if installed) counts finished PDFs.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+        async def extract(pdf_path: str):
+            async with semaphore:
+                start_time = loop.time()
+                try:
+                    extracted_data, error = await self.aextract_tables_from_pdf(pdf_path, target_tables, executor)
+                except Exception as e:
+                    logger.error(f"An error occurred during table extraction for {pdf_path}: {e}", exc_info=True)
+                    extracted_data, error = None, f"An error occurred during table extraction for {pdf_path}: {e}"
+                return pdf_path, extracted_data, error, loop.time() - start_time
+
+        tasks = [asyncio.ensure_future(extract(pdf_path)) for pdf_path in pdf_paths]
+        progress_bar = None
+        with contextlib.ExitStack() as stack:
+            if show_progress and tqdm:
+                # Route console logging through tqdm while the bar is shown, so log lines print above it.
+                stack.enter_context(logging_redirect_tqdm())
+                progress_bar = stack.enter_context(tqdm(total=len(tasks), desc="Extracting tables", unit="pdf"))
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    result = await next_done
+                    if progress_bar:
+                        progress_bar.update(1)
+                    yield result
+            finally:
+                for task in tasks:
+                    task.cancel()
+                executor.shutdown(wait=False)
+
+    def extract_tables_from_pdfs(self, pdf_paths: List[str], target_tables: List[str], max_concurrency: int = 8
+                                 ) -> Dict[str, Tuple[Dict[str, List[List[Any]]] | None, str | None]]:
+        """Blocking wrapper around aextract_tables_from_pdfs. Returns {pdf_path: (tables, error)}."""
+        async def collect():
+            return {pdf_path: (extracted_data, error)
+                    async for pdf_path, extracted_data, error, _ in self.aextract_tables_from_pdfs(
+                        pdf_paths, target_tables, max_concurrency)}
+
+        return asyncio.run(collect())
+
+    def _build_chat_prompt_parts(self, uploaded_pdf_files: Dict[str, Any], user_query: str) -> List[Any]:
+        """Builds the analyst prompt followed by the uploaded PDF file objects."""
+        pdf_references = "\n".join([f'- "{filename}" (File ID: {file_obj.name})' for filename, file_obj in uploaded_pdf_files.items()])
         
-        # Add the uploaded PDF file objects to the request.
+        prompt_parts = [CHAT_PROMPT_TEMPLATE.substitute(pdf_references=pdf_references, user_query=user_query)]
+        
+        # Reference the uploaded PDFs by URI.
         for file_obj in uploaded_pdf_files.values():
-            prompt_parts.append(file_obj)
+            prompt_parts.append(self._file_part(file_obj))
+        return prompt_parts
+
+    def _file_part(self, file_obj: genai.types.File) -> Dict[str, Any]:
+        """
+        Returns a file_data part pointing at an uploaded file. The SDK would build the same
+        part from the File object on every request; caching it skips that for later turns.
+        A plain dict is used because the SDK accepts it in every supported version.
+        """
+        key = (file_obj.name, file_obj.uri)
+        part = self._file_parts.get(key)
+        if part is None:
+            self._pdf_token_estimate(file_obj)
+            part = {"file_data": {"file_uri": file_obj.uri,
+                                  "mime_type": getattr(file_obj, 'mime_type', None) or "application/pdf"}}
+            self._file_parts[key] = part
+        return part
+
+    def generate_chat_response(self, uploaded_pdf_files: Dict[str, Any], user_query: str) -> Tuple[str | None, str | None]:
+        """Sends the user's question and the PDF context to Gemini to get a response."""
+        if not uploaded_pdf_files:
+            error_msg = "No PDF files provided for context."
+            logger.warning(error_msg)
+            return "I don't have any documents loaded to answer your question. Please load a document first.", error_msg
+        
+        logger.info(f"Generating chat response for query: '{user_query}' using {len(uploaded_pdf_files)} PDF(s).")
+        prompt_parts = self._build_chat_prompt_parts(uploaded_pdf_files, user_query)
 
         try:
-            response = self.model.generate_content(prompt_parts)
+            response = self._call_with_retry(prompt_parts)
             logger.info(f"Successfully generated chat response for query: '{user_query}'.")
             return response.text, None
         except Exception as e:
             error_msg = f"Error generating chat response from LLM: {e}"
             logger.error(error_msg, exc_info=True)
-            return None, error_msg 
\ No newline at end of file
+            return None, error_msg 
+
+    async def agenerate_chat_response(self, uploaded_pdf_files: Dict[str, Any], user_query: str) -> Tuple[str | None, str | None]:
+        """Async variant of generate_chat_response, so several questions can be in flight at once."""
+        if not uploaded_pdf_files:
+            error_msg = "No PDF files provided for context."
+            logger.warning(error_msg)
+            return "I don't have any documents loaded to answer your question. Please load a document first.", error_msg
+
+        logger.info(f"Generating chat response (async) for query: '{user_query}' using {len(uploaded_pdf_files)} PDF(s).")
+        prompt_parts = self._build_chat_prompt_parts(uploaded_pdf_files, user_query)
+
+        try:
+            response = await self._acall_with_retry(prompt_parts)
+            logger.info(f"Successfully generated chat response for query: '{user_query}'.")
+            return response.text, None
+        except Exception as e:
+            error_msg = f"Error generating chat response from LLM: {e}"
+            logger.error(error_msg, exc_info=True)
+            return None, error_msg
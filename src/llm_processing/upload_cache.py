@@ -0,0 +1,155 @@
+"""
+Keeps track of PDFs that were already uploaded to Gemini.
+
+Gemini keeps uploaded files for 48 hours, so a PDF whose content has not
+changed can be reused across sessions instead of being uploaded again.
+The index maps the SHA-256 of the file contents to the Gemini file name
+and is stored as a small JSON file.
+
+UploadedPdfRegistry sits on top of it for a single session: every unique
+PDF is uploaded at most once and the Gemini file object is kept in memory,
+so chat turns never wait on an upload again unless Gemini expired the file.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from src.llm_processing.gemini_service import GeminiService
+
+logger = logging.getLogger(__name__)
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hashes a file in 1 MiB chunks so large PDFs are never fully loaded into memory."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class UploadCache:
+    """A persistent mapping of file hash -> Gemini file name."""
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self._index: Dict[str, str] = {}
+        try:
+            with open(index_path, 'r') as f:
+                self._index = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Could not read upload cache at {index_path}, starting with an empty one: {e}")
+
+    def get(self, file_hash: str) -> Optional[str]:
+        """Returns the Gemini file name stored for a hash, if any."""
+        return self._index.get(file_hash)
+
+    def set(self, file_hash: str, file_name: str):
+        """Remembers the Gemini file name for a hash."""
+        self._index[file_hash] = file_name
+
+    def discard(self, file_hash: str):
+        """Forgets a hash, e.g. when Gemini no longer has the file."""
+        self._index.pop(file_hash, None)
+
+    def save(self):
+        """Writes the index back to disk."""
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(self.index_path, 'w') as f:
+                json.dump(self._index, f, indent=2)
+        except OSError as e:
+            logger.error(f"Failed to save upload cache to {self.index_path}: {e}")
+
+class UploadedPdfRegistry:
+    """
+    Session-wide map of PDF content -> uploaded Gemini file.
+
+    Entries are keyed by the first 16 hex digits of the PDF's SHA-256, so the same
+    document under two names is only uploaded once. Files older than REFRESH_AFTER
+    are checked with Gemini before reuse and uploaded again if they are gone.
+    Safe to use from several threads at once.
+    """
+    # Gemini deletes uploaded files after 48 hours; check an hour before that.
+    REFRESH_AFTER = timedelta(hours=47)
+
+    def __init__(self, upload_cache: Optional[UploadCache] = None):
+        self.upload_cache = upload_cache
+        self._files: Dict[str, Tuple[Any, float]] = {} # key -> (file, checked at, time.time())
+        self._path_keys: Dict[Tuple[str, int, int], Tuple[str, str]] = {} # (path, size, mtime) -> (key, full hash)
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+
+    def _hashes(self, pdf_path: str) -> Tuple[str, str]:
+        """Returns (registry key, full SHA-256) for a PDF, hashing it only when it changed."""
+        stat = os.stat(pdf_path)
+        memo_key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            hashes = self._path_keys.get(memo_key)
+        if hashes is None:
+            full_hash = file_sha256(pdf_path)
+            hashes = (full_hash[:16], full_hash)
+            with self._lock:
+                self._path_keys[memo_key] = hashes
+        return hashes
+
+    def _is_expired(self, uploaded_file: Any, checked_at: float) -> bool:
+        expiration_time = getattr(uploaded_file, 'expiration_time', None)
+        if isinstance(expiration_time, datetime):
+            # Leave the same one-hour margin as REFRESH_AFTER.
+            return datetime.now(timezone.utc) >= expiration_time - (timedelta(hours=48) - self.REFRESH_AFTER)
+        return time.time() - checked_at >= self.REFRESH_AFTER.total_seconds()
+
+    def get_or_upload(self, service: "GeminiService", pdf_path: str) -> Tuple[Optional[Any], Optional[str]]:
+        """
+        Returns (file, error) for a PDF, uploading it only if this session (or the
+        persistent upload cache) does not already have a usable copy on Gemini.
+        """
+        key, full_hash = self._hashes(pdf_path)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # One lock per document, so identical PDFs requested at the same time upload once.
+        with key_lock:
+            with self._lock:
+                entry = self._files.get(key)
+            if entry:
+                uploaded_file, checked_at = entry
+                if not self._is_expired(uploaded_file, checked_at):
+                    return uploaded_file, None
+                # Past the refresh point: ask Gemini whether the file still exists.
+                refreshed = service._get_active_file(uploaded_file.name)
+                if refreshed and not self._is_expired(refreshed, time.time()):
+                    self._remember(key, refreshed)
+                    return refreshed, None
+                logger.info(f"Uploaded copy of {pdf_path} has expired, uploading it again.")
+            elif self.upload_cache:
+                cached_name = self.upload_cache.get(full_hash)
+                if cached_name:
+                    cached_file = service._get_active_file(cached_name)
+                    if cached_file:
+                        logger.info(f"Reusing previously uploaded {pdf_path} ({cached_name}).")
+                        self._remember(key, cached_file)
+                        return cached_file, None
+                    self.upload_cache.discard(full_hash)
+
+            uploaded_file, error = service._upload_pdf(pdf_path)
+            if uploaded_file:
+                self._remember(key, uploaded_file)
+                if self.upload_cache:
+                    self.upload_cache.set(full_hash, uploaded_file.name)
+            return uploaded_file, error
+
+    def _remember(self, key: str, uploaded_file: Any):
+        with self._lock:
+            self._files[key] = (uploaded_file, time.time())
+
+    def save(self):
+        """Persists the upload cache, if one is used."""
+        if self.upload_cache:
+            self.upload_cache.save()
@@ -0,0 +1,118 @@
+"""
+Client-side rate limiting for Gemini API calls.
+
+Gemini enforces per-minute quotas on both requests and tokens. Rather than
+sleeping a fixed amount between calls, the limiter below keeps a token bucket
+for each quota so bursts go through immediately and sustained load settles
+right at the limit. Calls that still fail with a transient error (a quota
+error or a 5xx from the server) are retried with exponential backoff.
+"""
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+from google.api_core.exceptions import ResourceExhausted, ServerError, TooManyRequests
+
+logger = logging.getLogger(__name__)
+
+class AsyncLimiter:
+    """
+    A token-bucket limiter for requests per minute (RPM) and tokens per minute (TPM).
+
+    The buckets refill continuously based on elapsed time, so no background task
+    is needed and the same limiter can be shared by async and blocking callers.
+    """
+    def __init__(self, rpm: int, tpm: Optional[int] = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._request_allowance = float(rpm)
+        self._token_allowance = float(tpm or 0)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, est_tokens: int) -> float:
+        """Reserves capacity for one request and returns how many seconds the caller must wait."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_refill
+            self._last_refill = now
+
+            # Allowances may go negative: that is capacity already promised to waiting callers.
+            self._request_allowance = min(self.rpm, self._request_allowance + elapsed * self.rpm / 60)
+            self._request_allowance -= 1
+            wait = -self._request_allowance * 60 / self.rpm
+
+            if self.tpm:
+                # Cap the estimate so one oversized request cannot block the bucket forever.
+                tokens = min(est_tokens, self.tpm)
+                self._token_allowance = min(self.tpm, self._token_allowance + elapsed * self.tpm / 60)
+                self._token_allowance -= tokens
+                wait = max(wait, -self._token_allowance * 60 / self.tpm)
+
+            return max(0.0, wait)
+
+    @asynccontextmanager
+    async def acquire(self, est_tokens: int = 0):
+        """Waits (without blocking the event loop) until the request fits within the quota."""
+        wait = self._reserve(est_tokens)
+        if wait > 0:
+            logger.debug(f"Rate limiter delaying request by {wait:.2f}s.")
+            await asyncio.sleep(wait)
+        yield
+
+    @contextmanager
+    def acquire_blocking(self, est_tokens: int = 0):
+        """Same as acquire(), for synchronous callers."""
+        wait = self._reserve(est_tokens)
+        if wait > 0:
+            logger.debug(f"Rate limiter delaying request by {wait:.2f}s.")
+            time.sleep(wait)
+        yield
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Checks whether an exception is Gemini rejecting a call because of its quota (HTTP 429)."""
+    # Use the status code rather than searching the message for "429", which file IDs or names can contain.
+    if getattr(error, 'code', None) == 429:
+        return True
+    message = str(error).lower()
+    return "quota" in message or "resource has been exhausted" in message
+
+def is_transient_error(error: Exception) -> bool:
+    """Checks whether a failed call is worth retrying as is: a quota error or a server-side (5xx) error."""
+    return isinstance(error, (ServerError, ResourceExhausted, TooManyRequests)) or is_rate_limit_error(error)
+
+def backoff_delays(base_delay: float) -> Iterator[float]:
+    """Yields exponentially growing retry delays: base_delay, 2 * base_delay, 4 * base_delay, ..."""
+    delay = base_delay
+    while True:
+        yield delay
+        delay *= 2
+
+def retry_on_transient_error(func: Callable[[], Any], attempts: int = 3, base_delay: float = 1.0) -> Any:
+    """Calls func, retrying with exponential backoff if it fails with a transient error."""
+    delays = backoff_delays(base_delay)
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == attempts or not is_transient_error(e):
+                raise
+            delay = next(delays)
+            logger.warning(f"Transient Gemini error (attempt {attempt}/{attempts}): {e}. Retrying in {delay:.0f}s.")
+            time.sleep(delay)
+
+async def aretry_on_transient_error(func: Callable[[], Awaitable[Any]], attempts: int = 3, base_delay: float = 1.0) -> Any:
+    """Async variant of retry_on_transient_error."""
+    delays = backoff_delays(base_delay)
+    for attempt in range(1, attempts + 1):
+        try:
+            return await func()
+        except Exception as e:
+            if attempt == attempts or not is_transient_error(e):
+                raise
+            delay = next(delays)
+            logger.warning(f"Transient Gemini error (attempt {attempt}/{attempts}): {e}. Retrying in {delay:.0f}s.")
+            await asyncio.sleep(delay)
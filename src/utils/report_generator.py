@@ -8,102 +8,188 @@ from the chatbot's string output into formatted content in the Word document.
 from docx import Document
 from docx.shared import Pt, Inches, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_BREAK
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
 import logging
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from enum import Enum
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import re
+from xml.sax.saxutils import escape
 
 logger = logging.getLogger(__name__)
 
+# Markdown patterns used when formatting chatbot responses
+# Inline formatting tokens: **bold**, *italic*, and plain text (including stray asterisks).
+_TOKEN_RE = re.compile(r'(?P<bold>\*\*(.+?)\*\*)|(?P<italic>\*(.+?)\*)|(?P<text>[^*]+|\*+)')
+_LIST_ITEM_RE = re.compile(r'^\s*([*\-+]|\d+\.)\s+')
+# Table separator rows: pipe-delimited cells of hyphens with optional alignment colons (empty cells allowed).
+_SEPARATOR_RE = re.compile(r'^\|(?:\s*(?::?-+:?)?\s*\|)+$')
+
+def _add_extraction_log_entry(doc: Document, entry: Dict[str, Any]) -> None:
+    """Adds one processed PDF's section to the extraction log document."""
+    doc.add_heading(f"File: {entry.get('pdf_filename', 'Unknown File')}", level=2)
+    p = doc.add_paragraph()
+    p.add_run("Status: ").bold = True
+    p.add_run(str(entry.get('status', 'N/A')))
+    
+    if 'processing_time_seconds' in entry:
+        p_time = doc.add_paragraph()
+        p_time.add_run("Processing Time: ").bold = True
+        p_time.add_run(f"{entry['processing_time_seconds']:.2f} seconds")
+
+    p_msg = doc.add_paragraph()
+    p_msg.add_run("Details: ").bold = True
+    p_msg.add_run(str(entry.get('message', 'No details.')))
+
+    p_tables = doc.add_paragraph()
+    p_tables.add_run("Attempted/Extracted Tables: ").bold = True
+    tables_list = entry.get('extracted_tables', [])
+    if tables_list:
+         p_tables.add_run(", ".join(tables_list) if isinstance(tables_list, list) else str(tables_list))
+    else:
+        p_tables.add_run("None.")
+    doc.add_paragraph("-" * 20)
+
+class ExtractionLog:
+    """
+    Writes the .docx log for the table extraction process as it happens.
+
+    Use it as a context manager and call append() once per processed PDF. The
+    document is saved after every entry, so the log survives an interruption.
+    """
+    def __init__(self, output_filepath: str):
+        self.output_filepath = output_filepath
+        self.doc = None
+        self.num_entries = 0
+
+    def __enter__(self) -> "ExtractionLog":
+        self.doc = Document()
+        self.doc.add_heading('PDF Table Extraction Log', level=1)
+        self.doc.add_paragraph(f"Report generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        self.doc.add_paragraph("-" * 30)
+        return self
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        """Adds an entry to the log and saves the document."""
+        _add_extraction_log_entry(self.doc, entry)
+        self.num_entries += 1
+        self._save()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if not self.num_entries:
+            self.doc.add_paragraph("No PDF files were processed.")
+            self._save()
+        logger.info(f"Extraction log saved to: {self.output_filepath}")
+
+    def _save(self) -> None:
+        try:
+            self.doc.save(self.output_filepath)
+        except Exception as e:
+            logger.error(f"Failed to save extraction log to {self.output_filepath}: {e}")
+            print(f"Error: Failed to save extraction log to {self.output_filepath}: {e}")
+
 def generate_extraction_log(
     log_entries: List[Dict[str, Any]], 
     output_filepath: str
 ) -> None:
     """Creates a .docx log file for the table extraction process."""
-    doc = Document()
-    doc.add_heading('PDF Table Extraction Log', level=1)
-    doc.add_paragraph(f"Report generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    doc.add_paragraph("-" * 30)
-
-    if not log_entries:
-        doc.add_paragraph("No PDF files were processed.")
-    else:
+    with ExtractionLog(output_filepath) as extraction_log:
         for entry in log_entries:
-            doc.add_heading(f"File: {entry.get('pdf_filename', 'Unknown File')}", level=2)
-            p = doc.add_paragraph()
-            p.add_run("Status: ").bold = True
-            p.add_run(str(entry.get('status', 'N/A')))
-            
-            if 'processing_time_seconds' in entry:
-                p_time = doc.add_paragraph()
-                p_time.add_run("Processing Time: ").bold = True
-                p_time.add_run(f"{entry['processing_time_seconds']:.2f} seconds")
-
-            p_msg = doc.add_paragraph()
-            p_msg.add_run("Details: ").bold = True
-            p_msg.add_run(str(entry.get('message', 'No details.')))
-
-            p_tables = doc.add_paragraph()
-            p_tables.add_run("Attempted/Extracted Tables: ").bold = True
-            tables_list = entry.get('extracted_tables', [])
-            if tables_list:
-                 p_tables.add_run(", ".join(tables_list) if isinstance(tables_list, list) else str(tables_list))
-            else:
-                p_tables.add_run("None.")
-            doc.add_paragraph("-" * 20)
-            
-    try:
-        doc.save(output_filepath)
-        logger.info(f"Extraction log saved to: {output_filepath}")
-    except Exception as e:
-        logger.error(f"Failed to save extraction log to {output_filepath}: {e}")
-        print(f"Error: Failed to save extraction log to {output_filepath}: {e}")
-
-def _is_markdown_table_line(line: str) -> bool:
-    """Checks if a line is part of a Markdown table (e.g., | a | b |)."""
-    return line.strip().startswith("|") and line.strip().endswith("|")
-
-def _is_markdown_table_separator(line: str) -> bool:
-    """Checks if a line is a Markdown table separator (e.g., |---|---:|)."""
-    stripped_line = line.strip()
-    if not (_is_markdown_table_line(stripped_line) and stripped_line.count('|') >= 2):
-        return False
-    
-    parts = [part.strip() for part in stripped_line.strip('|').split('|')]
-    if not parts: # Should not happen if count('|') >= 2 but good for robustness
-        return False
-
-    # Check if content between pipes is only hyphens, optionally surrounded by colons
-    for part in parts:
-        if not part: # Can happen with || in separator, treat as valid
-            continue
-        # Remove optional colons at the start and end for the hyphen check
-        core_part = part
-        if core_part.startswith(':'):
-            core_part = core_part[1:]
-        if core_part.endswith(':'):
-            core_part = core_part[:-1]
-        
-        if not core_part or not all(c == '-' for c in core_part):
-            return False
-    return True
+            extraction_log.append(entry)
+
+class _LineKind(Enum):
+    """What a single line of a chatbot response represents."""
+    TABLE = "table"
+    LIST = "list"
+    TEXT = "text"
+
+def _is_markdown_table_line(stripped_line: str) -> bool:
+    """Checks if an already stripped line is part of a Markdown table (e.g., | a | b |)."""
+    return stripped_line.startswith("|") and stripped_line.endswith("|")
+
+def _is_markdown_table_separator(stripped_line: str) -> bool:
+    """Checks if an already stripped line is a Markdown table separator (e.g., |---|---:|)."""
+    return _SEPARATOR_RE.match(stripped_line) is not None
+
+def _classify(line: str, stripped_line: str) -> Tuple[_LineKind, Optional[re.Match]]:
+    """Classifies a response line. For list items the list-marker match is returned too."""
+    if _is_markdown_table_line(stripped_line):
+        return _LineKind.TABLE, None
+    list_match = _LIST_ITEM_RE.match(line)
+    if list_match:
+        return _LineKind.LIST, list_match
+    return _LineKind.TEXT, None
 
-def _parse_markdown_table_row(line: str) -> List[str]:
-    """Splits a Markdown table row into a list of cells."""
-    return [cell.strip() for cell in line.strip().strip('|').split('|')]
+def _parse_markdown_table_row(stripped_line: str) -> List[str]:
+    """Splits an already stripped Markdown table row into a list of cells."""
+    return [cell.strip() for cell in stripped_line.strip('|').split('|')]
 
 def _add_formatted_text(paragraph, text):
     """Adds text to a paragraph, handling **bold** and *italic* formatting."""
-    parts = re.split(r'(\*\*.*?\*\*|\*.*?\*)', text)
-    for part in parts:
-        if part.startswith('**') and part.endswith('**'):
-            run = paragraph.add_run(part[2:-2])
-            run.bold = True
-        elif part.startswith('*') and part.endswith('*'):
-            run = paragraph.add_run(part[1:-1])
-            run.italic = True
+    for match in _TOKEN_RE.finditer(text):
+        if match.lastgroup == 'bold':
+            paragraph.add_run(match.group(2)).bold = True
+        elif match.lastgroup == 'italic':
+            paragraph.add_run(match.group(4)).italic = True
         else:
-            paragraph.add_run(part)
+            paragraph.add_run(match.group(0))
+
+def _iter_lines_with_peek(text: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Yields (line, next_line) pairs without building a list of all lines.
+    next_line is None for the last line. Like splitlines(), a trailing newline does not add an empty line.
+    """
+    def lines() -> Iterator[str]:
+        start = 0
+        while start < len(text):
+            end = text.find('\n', start)
+            if end == -1:
+                end = len(text)
+            yield text[start:end].rstrip('\r')
+            start = end + 1
+
+    line_iter = lines()
+    line = next(line_iter, None)
+    while line is not None:
+        next_line = next(line_iter, None)
+        yield line, next_line
+        line = next_line
+
+def _fast_fill_table(word_table, table_rows: List[List[str]]) -> None:
+    """
+    Appends all rows to an empty Word table in one step.
+
+    Setting cell.text rebuilds each cell's paragraph through python-docx one by one,
+    so instead the <w:tr> XML for every row is built as a single string, parsed once
+    and attached to the table. The header row is made bold directly in the XML.
+    """
+    tbl = word_table._tbl
+    col_widths = [grid_col.w for grid_col in tbl.tblGrid.gridCol_lst]
+    empty_cells = [f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width.twips}"/></w:tcPr><w:p/></w:tc>'
+                   for width in col_widths]
+
+    row_xml = []
+    for r, row_data in enumerate(table_rows):
+        run_props = '<w:rPr><w:b/></w:rPr>' if r == 0 else ''
+        cells = [
+            f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{col_widths[c].twips}"/></w:tcPr>'
+            f'<w:p><w:r>{run_props}<w:t xml:space="preserve">{escape(cell_text)}</w:t></w:r></w:p></w:tc>'
+            for c, cell_text in enumerate(row_data[:len(col_widths)])
+        ]
+        # Short rows are padded with empty cells, as Word expects every row to fill the grid.
+        cells.extend(empty_cells[len(cells):])
+        row_xml.append(f"<w:tr>{''.join(cells)}</w:tr>")
+
+    rows = parse_xml(f"<w:tbl {nsdecls('w')}>{''.join(row_xml)}</w:tbl>")
+    tbl.extend(list(rows))
+
+def _add_word_table(doc: Document, table_rows: List[List[str]]) -> None:
+    """Adds a parsed Markdown table to the document, with a bold header row."""
+    if not table_rows:
+        return
+    word_table = doc.add_table(rows=0, cols=len(table_rows[0]), style='Table Grid')
+    _fast_fill_table(word_table, table_rows)
 
 def generate_chat_transcript(
     chat_history: List[Tuple[str, str]], 
@@ -116,6 +202,9 @@ def generate_chat_transcript(
     """
     doc = Document()
     doc.add_heading('Chatbot Session Transcript', level=1)
+    # Resolve the list styles once instead of looking them up by name for every list item.
+    bullet_style = doc.styles['List Bullet']
+    number_style = doc.styles['List Number']
     
     doc.add_paragraph(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     context_pdfs = ', '.join(loaded_pdfs) if loaded_pdfs else "None"
@@ -133,52 +222,46 @@ def generate_chat_transcript(
         p_chatbot_intro = doc.add_paragraph()
         p_chatbot_intro.add_run("Chatbot:").bold = True
         
-        # This block parses the chatbot's Markdown response line-by-line.
-        response_lines = chatbot_response.splitlines()
-        i = 0
-        while i < len(response_lines):
-            line = response_lines[i]
-            
-            # Check for and process a Markdown table.
-            if _is_markdown_table_line(line) and \
-               i + 1 < len(response_lines) and _is_markdown_table_separator(response_lines[i+1]):
-                
+        # This block parses the chatbot's Markdown response in a single pass over its lines.
+        # Each line is stripped once; a table starts at a table line followed by a separator
+        # and keeps collecting rows until the first non-table line.
+        table_rows: List[List[str]] = []
+        collecting_table = False
+        skip_separator = False
+
+        for line, next_line in _iter_lines_with_peek(chatbot_response):
+            if skip_separator:
+                skip_separator = False
+                continue
+
+            stripped_line = line.strip()
+            kind, list_match = _classify(line, stripped_line)
+
+            if collecting_table:
+                if kind is _LineKind.TABLE:
+                    table_rows.append(_parse_markdown_table_row(stripped_line))
+                    continue
+                _add_word_table(doc, table_rows)
                 table_rows = []
-                # Header
-                table_rows.append(_parse_markdown_table_row(line))
-                i += 2 # Move past header and separator
-                
-                # Data rows
-                while i < len(response_lines) and _is_markdown_table_line(response_lines[i]):
-                    table_rows.append(_parse_markdown_table_row(response_lines[i]))
-                    i += 1
-
-                # Create Word table
-                if table_rows:
-                    num_cols = len(table_rows[0])
-                    word_table = doc.add_table(rows=len(table_rows), cols=num_cols, style='Table Grid')
-                    for r, row_data in enumerate(table_rows):
-                        for c, cell_text in enumerate(row_data):
-                            if c < num_cols:
-                                word_table.cell(r, c).text = cell_text
-                    # Set header bold
-                    for cell in word_table.rows[0].cells:
-                        for paragraph in cell.paragraphs:
-                            for run in paragraph.runs:
-                                run.bold = True
-                continue # Continue to next line after table processing
+                collecting_table = False
 
+            # Check for the start of a Markdown table (header row followed by a separator).
+            if kind is _LineKind.TABLE and next_line is not None and \
+               _is_markdown_table_separator(next_line.strip()):
+                table_rows = [_parse_markdown_table_row(stripped_line)]
+                collecting_table = True
+                skip_separator = True
             # Check for and process a list item.
-            list_match = re.match(r"^\s*([*\-+]|\d+\.)\s+", line)
-            if list_match:
-                p = doc.add_paragraph(style='List Bullet' if not list_match.group(1).endswith('.') else 'List Number')
+            elif kind is _LineKind.LIST:
+                p = doc.add_paragraph(style=bullet_style if not list_match.group(1).endswith('.') else number_style)
                 _add_formatted_text(p, line[list_match.end():])
             # Otherwise, it's just a regular paragraph.
             else:
                 p = doc.add_paragraph()
                 _add_formatted_text(p, line)
-            
-            i += 1
+
+        if collecting_table:
+            _add_word_table(doc, table_rows)
         
         doc.add_paragraph() # Add space between messages.
 